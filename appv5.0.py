@@ -12,6 +12,8 @@ Features:
 """
 
 import os
+import copy
+import glob
 import time
 import zipfile
 import tempfile
@@ -19,17 +21,26 @@ import json
 from io import BytesIO
 from datetime import datetime
 from typing import List, Tuple, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
 import geopandas as gpd
 import folium
 from streamlit_folium import st_folium
 from folium.plugins import Draw
-from shapely.geometry import shape, Point
-from shapely.ops import unary_union
+import shapely
+from shapely.geometry import (
+    shape, Point, LineString, Polygon,
+    MultiPoint, MultiLineString, MultiPolygon, GeometryCollection
+)
 import mercantile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import osmnx as ox
 
 # ================================================================
@@ -86,6 +97,14 @@ if 'aoi_geometry' not in st.session_state:
     st.session_state.aoi_geometry = None
 if 'loaded_data' not in st.session_state:
     st.session_state.loaded_data = {}
+if 'loaded_data_geojson' not in st.session_state:
+    st.session_state.loaded_data_geojson = {}
+if 'layer_meta' not in st.session_state:
+    st.session_state.layer_meta = {}
+if 'bulk_download' not in st.session_state:
+    st.session_state.bulk_download = None
+if 'fetch_messages' not in st.session_state:
+    st.session_state.fetch_messages = []
 if 'selected_layers' not in st.session_state:
     st.session_state.selected_layers = []
 
@@ -135,22 +154,90 @@ DATA_SOURCES = {
     }
 }
 
+# Microsoft Buildings index and tile fetching limits
+MS_BUILDINGS_INDEX_URL = "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv"
+MS_BUILDINGS_INDEX_COLUMNS = ("Location", "QuadKey", "Url", "Size")
+MS_BUILDINGS_INDEX_SNAPSHOT = os.path.join(tempfile.gettempdir(), "ms_buildings_index.parquet")
+MS_BUILDINGS_INDEX_MAX_AGE = 86400  # The index changes rarely; refresh daily
+MS_BUILDINGS_MAX_TILES = 64
+MS_BUILDINGS_MAX_WORKERS = 8
+
+# Scratch space for export files (RAM-backed on Linux)
+RAM_TEMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Map overlays are simplified to roughly one metre (in degrees)
+DISPLAY_SIMPLIFY_TOLERANCE = 1e-5
+
+# Fetch results are cached per AOI, keyed on the geometry's WKB
+# (Streamlit matches hash_funcs on the exact type, so list every geometry class)
+AOI_HASH_FUNCS = {
+    geom_type: lambda g: g.wkb
+    for geom_type in (Point, LineString, Polygon, MultiPoint,
+                      MultiLineString, MultiPolygon, GeometryCollection)
+}
+
 # ================================================================
 # UTILITY FUNCTIONS
 # ================================================================
-@st.cache_data(ttl=3600)
-def load_microsoft_buildings_index():
-    """Load Microsoft Buildings dataset index"""
+@st.cache_resource
+def get_http_session():
+    """Shared HTTP session; keeps TLS connections alive across tile fetches"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    )
+    session.mount("https://", adapter)
+    return session
+
+def read_microsoft_buildings_index(columns=None):
+    """Read the Microsoft Buildings dataset index, preferring the local snapshot"""
     try:
-        url = "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv"
-        return pd.read_csv(url, dtype=str)
-    except Exception as e:
-        st.error(f"Failed to load Microsoft Buildings index: {e}")
-        return pd.DataFrame()
+        snapshot_age = time.time() - os.path.getmtime(MS_BUILDINGS_INDEX_SNAPSHOT)
+        if snapshot_age < MS_BUILDINGS_INDEX_MAX_AGE:
+            return pd.read_parquet(MS_BUILDINGS_INDEX_SNAPSHOT, columns=columns)
+    except Exception:
+        pass
+    
+    # pyarrow's multi-threaded reader; every column is kept as a string
+    response = get_http_session().get(MS_BUILDINGS_INDEX_URL, timeout=60)
+    response.raise_for_status()
+    table = pacsv.read_csv(
+        BytesIO(response.content),
+        convert_options=pacsv.ConvertOptions(
+            column_types={c: pa.string() for c in MS_BUILDINGS_INDEX_COLUMNS}
+        )
+    )
+    df_index = table.to_pandas(types_mapper=pd.ArrowDtype)
+    try:
+        df_index.to_parquet(MS_BUILDINGS_INDEX_SNAPSHOT, index=False)
+    except Exception:
+        pass  # Snapshot is only an optimisation
+    return df_index[columns] if columns else df_index
 
-def create_base_map(center=[24.7136, 46.6753], zoom=10):
-    """Create base map with drawing tools"""
-    m = folium.Map(location=center, zoom_start=zoom, tiles="OpenStreetMap")
+@st.cache_data(ttl=MS_BUILDINGS_INDEX_MAX_AGE)
+def load_microsoft_buildings_index():
+    """Load Microsoft Buildings dataset index (full table, for inspection)"""
+    # Errors are raised so a failed download is never cached
+    return read_microsoft_buildings_index()
+
+@st.cache_resource(ttl=MS_BUILDINGS_INDEX_MAX_AGE)
+def get_qk_url_map():
+    """Map Microsoft Buildings QuadKeys to tile URLs"""
+    # Only the lookup columns are read; no DataFrame is kept around.
+    # Download errors propagate, so a failure is never cached for the TTL
+    df_index = read_microsoft_buildings_index(columns=["QuadKey", "Url"])
+    if df_index.empty:
+        # Raise rather than return {} so an unavailable index is never cached
+        raise ValueError("Microsoft Buildings index is unavailable")
+    df_index = df_index.drop_duplicates("QuadKey")
+    return dict(zip(df_index["QuadKey"], df_index["Url"]))
+
+@st.cache_resource
+def _build_base_map(center, zoom):
+    """Build the base map template with drawing tools (shared across reruns)"""
+    m = folium.Map(location=list(center), zoom_start=zoom, tiles="OpenStreetMap")
     
     # Add drawing tools
     Draw(
@@ -167,6 +254,26 @@ def create_base_map(center=[24.7136, 46.6753], zoom=10):
     
     return m
 
+def create_base_map(center=(24.7136, 46.6753), zoom=10):
+    """Create base map with drawing tools"""
+    # Overlays are added per rerun, so hand out a copy of the cached template
+    return copy.deepcopy(_build_base_map(tuple(center), zoom))
+
+def create_display_geojson(gdf):
+    """Serialize a simplified copy of a layer for the map overlay"""
+    # Full-resolution data stays in session state for export; the map only
+    # needs coarse geometry and no attributes
+    display_geoms = gdf.geometry.simplify(DISPLAY_SIMPLIFY_TOLERANCE)
+    return display_geoms.to_json()
+
+def create_layer_meta(gdf):
+    """Summarize a layer once so the download table needn't rescan it"""
+    return {
+        "n": len(gdf),
+        "geom_types": tuple(gdf.geometry.geom_type.unique()),
+        "crs": str(gdf.crs)
+    }
+
 def process_uploaded_shapefile(uploaded_file):
     """Process uploaded shapefile and extract geometry"""
     try:
@@ -186,14 +293,14 @@ def process_uploaded_shapefile(uploaded_file):
                 raise ValueError("No .shp file found in the uploaded ZIP")
             
             shp_path = os.path.join(tmp_dir, shp_files[0])
-            gdf = gpd.read_file(shp_path)
+            gdf = gpd.read_file(shp_path, engine="pyogrio")
             
             # Convert to WGS84 if needed
             if gdf.crs and gdf.crs != 'EPSG:4326':
                 gdf = gdf.to_crs('EPSG:4326')
             
             # Union all geometries to create single AOI
-            aoi_geometry = unary_union(gdf.geometry.values)
+            aoi_geometry = shapely.union_all(gdf.geometry.values)
             
         os.unlink(tmp_path)
         return aoi_geometry
@@ -205,102 +312,158 @@ def process_uploaded_shapefile(uploaded_file):
 # ================================================================
 # DATA FETCHING FUNCTIONS
 # ================================================================
+def fetch_microsoft_buildings_tile(session, url, aoi_geometry, tile_in_aoi=False):
+    """Download one Microsoft Buildings tile and return geometries inside the AOI"""
+    lines = []
+    with session.get(url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        # Stream GeoJSON lines, keeping raw bytes for one batched parse
+        for line in response.iter_lines(chunk_size=65536, decode_unicode=False):
+            if line:
+                lines.append(line)
+    
+    if not lines:
+        return []
+    
+    # Parse every feature in a single GEOS call; each line is a GeoJSON Feature
+    geoms = shapely.from_geojson(np.array(lines, dtype=object), on_invalid="ignore")
+    geoms = geoms[~shapely.is_missing(geoms)]
+    if len(geoms) == 0:
+        return []
+    
+    # Every feature of a tile lying inside the AOI intersects it
+    if tile_in_aoi:
+        return list(geoms)
+    
+    # Filter the whole tile against the AOI with one R-tree query. The predicate
+    # query prepares the AOI itself on each call; a prepared AOI must not be
+    # shared across the worker threads, so it is deliberately left unprepared
+    tree = shapely.STRtree(geoms)
+    hits = tree.query(aoi_geometry, predicate="intersects")
+    return list(geoms[np.sort(hits)])
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False, hash_funcs=AOI_HASH_FUNCS)
 def fetch_microsoft_buildings(aoi_geometry):
-    """Fetch Microsoft Buildings data for AOI"""
+    """Fetch Microsoft Buildings data for AOI (errors are raised so they are never cached)"""
+    # Get tile quadkeys for AOI
+    minx, miny, maxx, maxy = aoi_geometry.bounds
+    tiles = list(mercantile.tiles(minx, miny, maxx, maxy, zooms=9))
+    
+    # Skip tiles that miss the AOI entirely (never downloaded) and flag
+    # tiles lying fully inside it, which need no per-feature test.
+    # A private prepared copy is used here only: prepared geometries must
+    # not be shared with the worker threads below.
+    prepared_aoi = shapely.from_wkb(aoi_geometry.wkb)
+    shapely.prepare(prepared_aoi)
+    tile_in_aoi = {}
+    for t in tiles:
+        tile_box = shapely.box(*mercantile.bounds(t))
+        if prepared_aoi.intersects(tile_box):
+            tile_in_aoi[mercantile.quadkey(t)] = prepared_aoi.contains(tile_box)
+    quad_keys = list(tile_in_aoi)[:MS_BUILDINGS_MAX_TILES]
+    
+    if not quad_keys:
+        return gpd.GeoDataFrame()
+    
+    # Load index
     try:
-        # Get tile quadkeys for AOI
-        minx, miny, maxx, maxy = aoi_geometry.bounds
-        tiles = list(mercantile.tiles(minx, miny, maxx, maxy, zooms=9))
-        quad_keys = [mercantile.quadkey(t) for t in tiles]
-        
-        if not quad_keys:
-            return gpd.GeoDataFrame()
-        
-        # Load index
-        df_index = load_microsoft_buildings_index()
-        if df_index.empty:
-            return gpd.GeoDataFrame()
-        
-        # Fetch data
-        all_buildings = []
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        for i, qk in enumerate(quad_keys[:10]):  # Limit to first 10 tiles for performance
-            status_text.text(f"Fetching tile {i+1}/{min(len(quad_keys), 10)}")
-            
-            tile_data = df_index[df_index["QuadKey"] == qk]
-            if not tile_data.empty:
-                url = tile_data.iloc[0]["Url"]
+        qk_to_url = get_qk_url_map()
+    except Exception as e:
+        raise RuntimeError(f"Failed to load Microsoft Buildings index: {e}") from e
+    
+    # Resolve tile URLs with O(1) lookups
+    tile_urls = [(qk, qk_to_url[qk]) for qk in quad_keys if qk in qk_to_url]
+    if not tile_urls:
+        return gpd.GeoDataFrame()
+    
+    # Fetch tiles concurrently; order is irrelevant since results are concatenated.
+    # Columns are collected as parallel lists rather than one dict per feature.
+    geoms = []
+    tile_ids = []
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    session = get_http_session()
+    try:
+        with ThreadPoolExecutor(max_workers=MS_BUILDINGS_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(
+                    fetch_microsoft_buildings_tile, session, url, aoi_geometry, tile_in_aoi[qk]
+                ): qk
+                for qk, url in tile_urls
+            }
+            for i, future in enumerate(as_completed(futures)):
+                status_text.text(f"Fetched tile {i+1}/{len(futures)}")
                 try:
-                    response = requests.get(url, timeout=30)
-                    if response.status_code == 200:
-                        # Parse GeoJSON lines
-                        for line in response.text.strip().split('\n'):
-                            if line:
-                                feature = json.loads(line)
-                                geom = shape(feature['geometry'])
-                                if geom.intersects(aoi_geometry):
-                                    all_buildings.append({
-                                        'geometry': geom,
-                                        'source': 'Microsoft Buildings',
-                                        'tile_id': qk
-                                    })
-                except Exception as e:
-                    continue
-            
-            progress_bar.progress((i + 1) / min(len(quad_keys), 10))
-        
+                    tile_geoms = future.result()
+                except Exception:
+                    # A partial result must not be cached as complete; stop
+                    # downloading and let the caller report the failure
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                geoms.extend(tile_geoms)
+                tile_ids.extend([futures[future]] * len(tile_geoms))
+                progress_bar.progress((i + 1) / len(futures))
+    finally:
         progress_bar.empty()
         status_text.empty()
-        
-        if all_buildings:
-            return gpd.GeoDataFrame(all_buildings, crs='EPSG:4326')
-        else:
-            return gpd.GeoDataFrame()
-            
-    except Exception as e:
-        st.error(f"Error fetching Microsoft Buildings: {e}")
+    
+    if geoms:
+        return gpd.GeoDataFrame(
+            {'source': 'Microsoft Buildings', 'tile_id': tile_ids},
+            geometry=geoms,
+            crs='EPSG:4326'
+        )
+    else:
         return gpd.GeoDataFrame()
 
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False, hash_funcs=AOI_HASH_FUNCS)
 def fetch_osm_data(aoi_geometry, tags):
-    """Fetch OSM data for AOI"""
-    try:
-        with st.spinner("Fetching OSM data..."):
-            gdf = ox.features_from_polygon(aoi_geometry, tags=tags)
-            
-            if not gdf.empty:
-                # Clean and simplify data
+    """Fetch OSM data for AOI (errors are raised so they are never cached)"""
+    with st.spinner("Fetching OSM data..."):
+        gdf = ox.features_from_polygon(aoi_geometry, tags=tags)
+        
+        if not gdf.empty:
+            # Keep only essential columns, projecting before the index reset
+            # so the full OSM result is not copied
+            essential_cols = ['geometry', 'name', 'highway', 'building', 'amenity', 'waterway', 'leisure']
+            available_cols = [col for col in essential_cols if col in gdf.columns]
+            if len(available_cols) > 1:  # Keep geometry + at least one other column
+                gdf = gdf.loc[:, available_cols].reset_index(drop=True)
+            else:
                 gdf = gdf.reset_index()
-                # Keep only essential columns
-                essential_cols = ['geometry', 'name', 'highway', 'building', 'amenity', 'waterway', 'leisure']
-                available_cols = [col for col in essential_cols if col in gdf.columns]
-                if len(available_cols) > 1:  # Keep geometry + at least one other column
-                    gdf = gdf[available_cols]
-                
-            return gdf
             
-    except Exception as e:
-        st.error(f"Error fetching OSM data: {e}")
-        return gpd.GeoDataFrame()
+        return gdf
 
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False, hash_funcs=AOI_HASH_FUNCS)
 def fetch_natural_earth_countries(aoi_geometry):
     """Fetch Natural Earth countries data (placeholder)"""
-    try:
-        # In a real implementation, you would fetch from Natural Earth
-        # This is a placeholder that creates a simple point
-        center = aoi_geometry.centroid
-        return gpd.GeoDataFrame({
-            'name': ['Sample Country'],
-            'geometry': [center]
-        }, crs='EPSG:4326')
-    except Exception as e:
-        st.error(f"Error fetching Natural Earth data: {e}")
-        return gpd.GeoDataFrame()
+    # In a real implementation, you would fetch from Natural Earth
+    # This is a placeholder that creates a simple point
+    center = aoi_geometry.centroid
+    return gpd.GeoDataFrame({
+        'name': ['Sample Country'],
+        'geometry': [center]
+    }, crs='EPSG:4326')
 
 # ================================================================
 # EXPORT FUNCTIONS
 # ================================================================
+def create_shapefile_zip(gdf, safe_name, tmp_root):
+    """Write a shapefile under tmp_root and return its components as ZIP bytes"""
+    with tempfile.TemporaryDirectory(dir=tmp_root) as tmp_dir:
+        shp_path = os.path.join(tmp_dir, f"{safe_name}.shp")
+        gdf.to_file(shp_path, driver="ESRI Shapefile", engine="pyogrio")
+        
+        # Create ZIP with all shapefile components
+        zip_buffer = BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for file_path in glob.glob(os.path.join(tmp_dir, f"{glob.escape(safe_name)}.*")):
+                zf.write(file_path, os.path.basename(file_path))
+        
+        return zip_buffer.getvalue()
+
 def export_layer_data(gdf, layer_name, format_type):
     """Export layer data in specified format"""
     if gdf.empty:
@@ -322,22 +485,25 @@ def export_layer_data(gdf, layer_name, format_type):
             mime = "text/csv"
             
         elif format_type == "Shapefile":
-            # Create shapefile ZIP
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                shp_path = os.path.join(tmp_dir, f"{safe_name}.shp")
-                gdf.to_file(shp_path, driver="ESRI Shapefile")
-                
-                # Create ZIP with all shapefile components
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    for file in os.listdir(tmp_dir):
-                        if file.startswith(safe_name):
-                            zf.write(os.path.join(tmp_dir, file), file)
-                
-                data = zip_buffer.getvalue()
-                filename = f"{safe_name}_shapefile.zip"
-                mime = "application/zip"
+            # Stage components in RAM when tmpfs is available; it may be small
+            # (64 MB by default in Docker), so fall back to the disk temp dir
+            try:
+                data = create_shapefile_zip(gdf, safe_name, RAM_TEMP_DIR)
+            except Exception:
+                if RAM_TEMP_DIR is None:
+                    raise
+                data = create_shapefile_zip(gdf, safe_name, None)
+            filename = f"{safe_name}_shapefile.zip"
+            mime = "application/zip"
                 
+        elif format_type == "GeoParquet":
+            # Columnar WKB geometry, compressed; much smaller than shapefile/CSV
+            buffer = BytesIO()
+            gdf.to_parquet(buffer, compression="snappy")
+            data = buffer.getvalue()
+            filename = f"{safe_name}.parquet"
+            mime = "application/vnd.apache.parquet"
+            
         else:
             return None
             
@@ -402,7 +568,7 @@ with st.sidebar:
     st.markdown("## 📁 Export Format")
     export_format = st.selectbox(
         "Choose export format:",
-        ["GeoJSON", "CSV", "Shapefile"]
+        ["GeoJSON", "CSV", "Shapefile", "GeoParquet"]
     )
     
     st.markdown("---")
@@ -415,19 +581,9 @@ with st.sidebar:
         help="Upload a ZIP file containing shapefile components"
     )
 
-# Main content area
-col1, col2 = st.columns([2, 1])
-
-with col1:
-    st.markdown("### 🗺️ Area of Interest Selection")
-    
-    # Process uploaded shapefile
-    if uploaded_shapefile and st.session_state.aoi_geometry is None:
-        aoi_from_file = process_uploaded_shapefile(uploaded_shapefile)
-        if aoi_from_file:
-            st.session_state.aoi_geometry = aoi_from_file
-            st.success("✅ Shapefile uploaded successfully!")
-    
+@st.fragment
+def aoi_map_panel():
+    """Render the AOI map; pans and draws rerun only this fragment"""
     # Create and display map
     base_map = create_base_map()
     
@@ -445,11 +601,11 @@ with col1:
     
     # Add loaded data to map
     colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8C8']
-    for i, (layer_name, gdf) in enumerate(st.session_state.loaded_data.items()):
-        if not gdf.empty:
+    for i, (layer_name, layer_geojson) in enumerate(st.session_state.loaded_data_geojson.items()):
+        if layer_geojson:
             color = colors[i % len(colors)]
             folium.GeoJson(
-                gdf,
+                data=layer_geojson,
                 name=layer_name,
                 style_function=lambda x, color=color: {
                     'fillColor': color,
@@ -464,6 +620,31 @@ with col1:
     
     # Display map
     map_data = st_folium(base_map, height=500, width="100%", returned_objects=["last_active_drawing"])
+    
+    # Process map interactions; comparing WKB hashes is far cheaper than
+    # equals_exact on complex polygons
+    if map_data and map_data.get("last_active_drawing"):
+        new_aoi = shape(map_data["last_active_drawing"]["geometry"])
+        new_aoi_hash = hash(new_aoi.wkb)
+        if new_aoi_hash != st.session_state.get("_aoi_hash"):
+            st.session_state.aoi_geometry = new_aoi
+            st.session_state._aoi_hash = new_aoi_hash
+            st.rerun()
+
+# Main content area
+col1, col2 = st.columns([2, 1])
+
+with col1:
+    st.markdown("### 🗺️ Area of Interest Selection")
+    
+    # Process uploaded shapefile
+    if uploaded_shapefile and st.session_state.aoi_geometry is None:
+        aoi_from_file = process_uploaded_shapefile(uploaded_shapefile)
+        if aoi_from_file:
+            st.session_state.aoi_geometry = aoi_from_file
+            st.success("✅ Shapefile uploaded successfully!")
+    
+    aoi_map_panel()
 
 with col2:
     st.markdown("### 🎛️ Control Panel")
@@ -485,27 +666,45 @@ with col2:
     if selected_sources and st.session_state.aoi_geometry:
         if st.button("🚀 Fetch Selected Data", type="primary", use_container_width=True):
             st.session_state.loaded_data = {}
+            st.session_state.loaded_data_geojson = {}
+            st.session_state.layer_meta = {}
+            st.session_state.bulk_download = None
+            st.session_state.fetch_messages = []
             
             for source_name in selected_sources:
                 with st.spinner(f"Loading {source_name}..."):
-                    if source_name == "Microsoft Buildings":
-                        gdf = fetch_microsoft_buildings(st.session_state.aoi_geometry)
-                    elif source_name.startswith("OpenStreetMap"):
-                        config = DATA_SOURCES[source_name]
-                        if "osm_tags" in config:
-                            gdf = fetch_osm_data(st.session_state.aoi_geometry, config["osm_tags"])
+                    # Fetch errors are handled here, outside the cached
+                    # functions, so a failed source is retried on the next fetch
+                    try:
+                        if source_name == "Microsoft Buildings":
+                            gdf = fetch_microsoft_buildings(st.session_state.aoi_geometry)
+                        elif source_name.startswith("OpenStreetMap"):
+                            config = DATA_SOURCES[source_name]
+                            if "osm_tags" in config:
+                                gdf = fetch_osm_data(st.session_state.aoi_geometry, config["osm_tags"])
+                            else:
+                                gdf = gpd.GeoDataFrame()
+                        elif source_name == "Natural Earth Countries":
+                            gdf = fetch_natural_earth_countries(st.session_state.aoi_geometry)
                         else:
                             gdf = gpd.GeoDataFrame()
-                    elif source_name == "Natural Earth Countries":
-                        gdf = fetch_natural_earth_countries(st.session_state.aoi_geometry)
-                    else:
-                        gdf = gpd.GeoDataFrame()
+                    except Exception as e:
+                        st.session_state.fetch_messages.append(
+                            ("error", f"❌ {source_name}: {e}")
+                        )
+                        continue
                     
                     if not gdf.empty:
                         st.session_state.loaded_data[source_name] = gdf
-                        st.success(f"✅ {source_name}: {len(gdf)} features")
+                        st.session_state.loaded_data_geojson[source_name] = create_display_geojson(gdf)
+                        st.session_state.layer_meta[source_name] = create_layer_meta(gdf)
+                        st.session_state.fetch_messages.append(
+                            ("success", f"✅ {source_name}: {len(gdf)} features")
+                        )
                     else:
-                        st.warning(f"⚠️ {source_name}: No data found")
+                        st.session_state.fetch_messages.append(
+                            ("warning", f"⚠️ {source_name}: No data found")
+                        )
             
             st.rerun()
     else:
@@ -514,19 +713,20 @@ with col2:
         if not st.session_state.aoi_geometry:
             st.info("Define an area of interest first")
     
+    # Results of the last fetch, kept in session state to survive its rerun
+    for level, message in st.session_state.fetch_messages:
+        getattr(st, level)(message)
+    
     # Clear data
     if st.session_state.loaded_data:
         if st.button("🗑️ Clear All Data", use_container_width=True):
             st.session_state.loaded_data = {}
+            st.session_state.loaded_data_geojson = {}
+            st.session_state.layer_meta = {}
+            st.session_state.bulk_download = None
+            st.session_state.fetch_messages = []
             st.rerun()
 
-# Process map interactions
-if map_data and map_data.get("last_active_drawing"):
-    new_aoi = shape(map_data["last_active_drawing"]["geometry"])
-    if not st.session_state.aoi_geometry or not new_aoi.equals_exact(st.session_state.aoi_geometry, tolerance=1e-6):
-        st.session_state.aoi_geometry = new_aoi
-        st.rerun()
-
 # Data preview and download section
 if st.session_state.loaded_data:
     st.markdown("---")
@@ -547,11 +747,11 @@ if st.session_state.loaded_data:
     st.markdown("### 📥 Download Center")
     
     download_data = []
-    for layer_name, gdf in st.session_state.loaded_data.items():
+    for layer_name, meta in st.session_state.layer_meta.items():
         download_data.append({
             "Layer": layer_name,
-            "Features": f"{len(gdf):,}",
-            "Geometry": ", ".join(gdf.geometry.geom_type.unique()),
+            "Features": f"{meta['n']:,}",
+            "Geometry": ", ".join(meta["geom_types"]),
             "Select": False
         })
     
@@ -606,7 +806,16 @@ if st.session_state.loaded_data:
                 st.info(f"Selected: {', '.join(selected_for_bulk)}")
             
             with col2:
-                bulk_data = create_bulk_download(selected_data, export_format)
+                # Rebuild the ZIP only when the selection or format changes
+                bulk_key = (tuple(selected_for_bulk), export_format)
+                cached_bulk = st.session_state.bulk_download
+                if cached_bulk and cached_bulk["key"] == bulk_key:
+                    bulk_data = cached_bulk["data"]
+                else:
+                    bulk_data = create_bulk_download(selected_data, export_format)
+                    # Failures aren't stored, so the next rerun retries them
+                    if bulk_data:
+                        st.session_state.bulk_download = {"key": bulk_key, "data": bulk_data}
                 if bulk_data:
                     st.download_button(
                         "📦 Download Selected Layers",
@@ -623,6 +832,7 @@ if st.session_state.loaded_data:
         
         if preview_layer:
             preview_gdf = st.session_state.loaded_data[preview_layer]
+            preview_meta = st.session_state.layer_meta[preview_layer]
             if not preview_gdf.empty:
                 # Show first 10 rows without geometry
                 preview_df = preview_gdf.drop(columns='geometry').head(10)
@@ -631,11 +841,11 @@ if st.session_state.loaded_data:
                 # Layer statistics
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric("Features", len(preview_gdf))
+                    st.metric("Features", preview_meta["n"])
                 with col2:
                     st.metric("Attributes", len(preview_gdf.columns) - 1)
                 with col3:
-                    st.metric("CRS", str(preview_gdf.crs))
+                    st.metric("CRS", preview_meta["crs"])
 
 # Footer
 st.markdown("---")